@@ -1,14 +1,23 @@
 import sys
 import os
 import configparser
-from datetime import datetime
+import csv
+import heapq
+import io
+import json
+import multiprocessing
+import zipfile
+from itertools import islice, repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton,
     QLabel, QComboBox, QLineEdit, QMessageBox, QTabWidget,
-    QListWidget, QInputDialog, QTableWidget, QTableWidgetItem, QDateTimeEdit, QFileDialog, QDateEdit, QHeaderView
+    QListWidget, QInputDialog, QTableWidget, QTableWidgetItem, QDateTimeEdit, QFileDialog, QDateEdit, QHeaderView,
+    QProgressDialog
 )
-from PyQt5.QtCore import QDateTime, QDate, Qt
-from PyQt5.QtGui import QPixmap, QFont, QIcon
+from PyQt5.QtCore import QDateTime, QDate, Qt, QTimer, QFileSystemWatcher
+from PyQt5.QtGui import QPixmap, QFont, QIcon, QColor
 from openpyxl import Workbook, load_workbook
 
 def get_base_path():
@@ -59,6 +68,408 @@ def get_config_path():
 CONFIG_FILE = get_config_path()
 
 
+# 需要重新檢查的檔案少於此數量時直接在主行程檢查，啟動子行程（exe 模式需重新載入 PyQt5）反而較慢
+AUDIT_POOL_MIN_FILES = 8
+
+
+def file_stamp(file):
+    """以一次 os.stat 取得 (修改時間奈秒, 檔案大小)；網路磁碟的修改時間精度可能只有 2 秒，需搭配大小判斷"""
+    st = os.stat(file)
+    return st.st_mtime_ns, st.st_size
+
+
+# 僅供參考、不算異常的檢查結果
+AUDIT_INFO_KINDS = ("值班中",)
+
+
+def audit_attendance_file(file, today):
+    """檢查單一打卡檔中會被工時計算略過的異常紀錄，回傳 [(列號, 問題, 說明)]（可在子行程執行）
+    最後一筆簽到若是今天（today）的，視為正在值班，只列為提醒
+    """
+    issues = []
+    try:
+        wb = load_workbook(file, read_only=True)
+    except Exception as e:
+        return [(None, "檔案無法讀取", str(e))]
+    ws = wb.active
+    last_signin = None   # (列號, 時間)：尚未配對的簽到
+    last_signout = None  # 上一組簽到退的簽退時間
+    last_dt = None
+    for row_no, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+        if not row or all(v is None for v in row):
+            continue
+        action = row[1] if len(row) > 1 else None
+        timestamp = row[3] if len(row) > 3 else None
+        try:
+            dt = datetime.strptime(str(timestamp), "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            issues.append((row_no, "時間格式錯誤", f"無法解析時間：{timestamp}"))
+            continue
+        if last_dt and dt < last_dt:
+            issues.append((row_no, "時間倒序", f"{timestamp} 早於上一筆 {last_dt.strftime('%Y-%m-%d %H:%M:%S')}"))
+        last_dt = dt
+
+        if action == "簽到":
+            if last_signin:
+                issues.append((last_signin[0], "未簽退", f"簽到後未簽退即於第 {row_no} 列再次簽到，此筆未計入工時"))
+            if last_signout and dt < last_signout:
+                issues.append((row_no, "時段重疊", f"簽到時間早於前一組的簽退時間 {last_signout.strftime('%Y-%m-%d %H:%M:%S')}"))
+            last_signin = (row_no, dt)
+        elif action == "簽退":
+            if not last_signin:
+                issues.append((row_no, "孤立簽退", "沒有對應的簽到，此筆未計入工時"))
+                continue
+            if dt <= last_signin[1]:
+                issues.append((row_no, "時長異常", f"簽退時間不晚於第 {last_signin[0]} 列的簽到時間"))
+            last_signout = dt
+            last_signin = None
+        else:
+            issues.append((row_no, "未知動作", f"無法辨識的動作：{action}"))
+    wb.close()
+
+    if last_signin:
+        if last_signin[1].date() < today:
+            issues.append((last_signin[0], "未簽退", "最後一筆簽到在今天以前，至今尚未簽退"))
+        else:
+            issues.append((last_signin[0], "值班中", "今天簽到，尚未簽退（提醒）"))
+    issues.sort(key=lambda x: x[0])
+    return issues
+
+
+def pair_punch_rows(rows):
+    """依列的順序配對簽到/簽退，逐筆產生 (簽到時間, 簽退時間, 是否含補打卡)；未配對的紀錄略過，與工時計算相同"""
+    last_signin = None
+    last_signin_manual = False
+    for row in rows:
+        if not row or not row[1]:
+            continue
+        action, timestamp = row[1], row[3]
+        manual = len(row) > 4 and row[4] == "是"
+        dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+        if action == "簽到":
+            last_signin = dt
+            last_signin_manual = manual
+        elif action == "簽退" and last_signin:
+            yield last_signin, dt, last_signin_manual or manual
+            last_signin = None
+
+
+def iter_punch_pairs(file):
+    """依檔案順序配對打卡檔中的簽到/簽退"""
+    wb = load_workbook(file, read_only=True)
+    ws = wb.active
+    try:
+        yield from pair_punch_rows(ws.iter_rows(min_row=2, values_only=True))
+    finally:
+        wb.close()
+
+
+def iter_sessions(file):
+    """逐筆產生 (簽到時間, 簽退時間)"""
+    for signin, signout, _ in iter_punch_pairs(file):
+        yield signin, signout
+
+
+# 值班明細匯出（CSV / JSON Lines）的欄位
+SESSION_EXPORT_FIELDS = ["name", "signin_epoch", "signout_epoch", "duration_seconds", "manual"]
+
+
+def iter_session_export_rows(names, files):
+    """依人員逐檔串流所有配對好的值班紀錄，一次只保留一筆在記憶體中"""
+    for name, file in zip(names, files):
+        if not os.path.exists(file):
+            continue
+        for signin, signout, manual in iter_punch_pairs(file):
+            yield {
+                "name": name,
+                "signin_epoch": int(signin.timestamp()),
+                "signout_epoch": int(signout.timestamp()),
+                "duration_seconds": int((signout - signin).total_seconds()),
+                "manual": manual,
+            }
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_sessions_csv(f, rows, chunk_size=1000):
+    writer = csv.DictWriter(f, fieldnames=SESSION_EXPORT_FIELDS)
+    writer.writeheader()
+    count = 0
+    for chunk in iter_chunks(rows, chunk_size):
+        writer.writerows(dict(row, manual=int(row["manual"])) for row in chunk)
+        count += len(chunk)
+    return count
+
+
+def write_sessions_jsonl(f, rows, chunk_size=1000):
+    count = 0
+    for chunk in iter_chunks(rows, chunk_size):
+        f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk))
+        count += len(chunk)
+    return count
+
+
+def load_person_sessions(name, file, start_date, end_date):
+    """回傳某人簽到或簽退日期落在區間內的值班紀錄 [(簽到, 簽退, 姓名)]，依簽到時間排序"""
+    if not os.path.exists(file):
+        return []
+    sessions = [(signin, signout, name) for signin, signout in iter_sessions(file)
+                if start_date <= signin.date() <= end_date or start_date <= signout.date() <= end_date]
+    sessions.sort(key=lambda x: x[0])
+    return sessions
+
+
+def coverage_slots(sessions, range_start, range_end):
+    """掃描依簽到時間排序的值班紀錄，產生連續時段 (開始, 結束, 在班人數)；人數為 0 表示無人值班"""
+    def raw_slots():
+        ends = []  # 目前在班者的簽退時間（最小堆）
+        cursor = range_start
+        for signin, signout, _ in sessions:
+            signin = max(signin, range_start)
+            signout = min(signout, range_end)
+            if signout <= signin:
+                continue
+            while ends and ends[0] <= signin:
+                end = heapq.heappop(ends)
+                if end > cursor:
+                    yield cursor, end, len(ends) + 1
+                    cursor = end
+            if signin > cursor:
+                yield cursor, signin, len(ends)
+                cursor = signin
+            heapq.heappush(ends, signout)
+        while ends:
+            end = heapq.heappop(ends)
+            if end > cursor:
+                yield cursor, end, len(ends) + 1
+                cursor = end
+        if cursor < range_end:
+            yield cursor, range_end, 0
+
+    # 合併人數相同的相鄰時段
+    pending = None
+    for start, end, count in raw_slots():
+        if pending and pending[2] == count:
+            pending = (pending[0], end, count)
+            continue
+        if pending:
+            yield pending
+        pending = (start, end, count)
+    if pending:
+        yield pending
+
+
+def build_person_sheet_rows(name, file, start_date, end_date):
+    """產生某人工時明細副表單的內容（含標題列），日期篩選方式與工時計算相同（可在子行程執行）"""
+    rows = [["姓名", "簽到時間", "簽退時間", "值班時長"]]
+    if os.path.exists(file):
+        for signin, signout in iter_sessions(file):
+            if (start_date is None or signin.date() >= start_date) and \
+               (end_date is None or signout.date() <= end_date):
+                delta = signout - signin
+                hours = int(delta.total_seconds() // 3600)
+                minutes = int((delta.total_seconds() % 3600) // 60)
+                rows.append([name,
+                             signin.strftime("%Y-%m-%d %H:%M:%S"),
+                             signout.strftime("%Y-%m-%d %H:%M:%S"),
+                             f"{hours:02d}:{minutes:02d}"])
+    return name, rows
+
+
+def build_person_workbook(name, file, start_date, end_date):
+    """在子行程中直接把某人的工時明細序列化成 xlsx，回傳 (姓名, 檔案內容)"""
+    _, rows = build_person_sheet_rows(name, file, start_date, end_date)
+    return name, rows_to_xlsx_bytes(name, rows)
+
+
+def rows_to_xlsx_bytes(title, rows):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=title)
+    for row in rows:
+        ws.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def find_open_signin(file):
+    """依檔案順序判斷目前是否在班：最後一筆為簽到則回傳其時間，否則回傳 None"""
+    if not os.path.exists(file):
+        return None
+    wb = load_workbook(file, read_only=True)
+    ws = wb.active
+    last = None
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        if row and len(row) > 3 and row[1]:
+            last = row
+    wb.close()
+    if last and last[1] == "簽到":
+        try:
+            return datetime.strptime(last[3], "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+# 匯入檔可接受的欄位名稱、動作寫法與時間格式
+PUNCH_COLUMNS = {
+    "name": ("姓名", "name"),
+    "action": ("動作", "action"),
+    "time": ("時間", "time", "timestamp"),
+}
+PUNCH_ACTIONS = {"簽到": "簽到", "簽退": "簽退", "in": "簽到", "out": "簽退"}
+PUNCH_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y/%m/%d %H:%M")
+
+
+def parse_punch_time(text):
+    for fmt in PUNCH_TIME_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def read_punch_file(path):
+    """讀取 CSV / 刷卡機匯出檔，依人員分組並依時間排序
+    回傳 ({姓名: [(時間, 動作, 行號)]}, [(行號, 錯誤)])；刷卡機檔沒有動作欄時動作為 None，匯入時依前一筆推算
+    """
+    rows = None
+    for encoding in ("utf-8-sig", "cp950"):
+        try:
+            with open(path, "r", encoding=encoding, newline="") as f:
+                rows = list(csv.reader(f))
+            break
+        except UnicodeDecodeError:
+            continue
+    if rows is None:
+        return {}, [(1, "無法辨識檔案編碼（請存成 UTF-8 或 Big5）")]
+    if not rows:
+        return {}, [(1, "檔案是空的")]
+
+    header = [h.strip().lower() for h in rows[0]]
+    index = {}
+    for key, aliases in PUNCH_COLUMNS.items():
+        for alias in aliases:
+            if alias in header:
+                index[key] = header.index(alias)
+                break
+    if "name" not in index or "time" not in index:
+        return {}, [(1, "標題列必須包含「姓名」與「時間」欄位")]
+
+    punches = {}
+    errors = []
+    now = datetime.now()
+    for line_no, row in enumerate(rows[1:], start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            name = row[index["name"]].strip()
+            time_text = row[index["time"]]
+            action_text = row[index["action"]].strip() if "action" in index else ""
+        except IndexError:
+            errors.append((line_no, "欄位數量不足"))
+            continue
+        dt = parse_punch_time(time_text)
+        if not name or dt is None:
+            errors.append((line_no, f"姓名或時間無法辨識：{name} {time_text}"))
+            continue
+        # 與補打卡相同，不接受未來的時間
+        if dt > now:
+            errors.append((line_no, f"{name} 的打卡時間 {dt} 晚於現在"))
+            continue
+        action = None
+        if action_text:
+            action = PUNCH_ACTIONS.get(action_text.lower(), PUNCH_ACTIONS.get(action_text))
+            if action is None:
+                errors.append((line_no, f"無法辨識的動作：{action_text}"))
+                continue
+        punches.setdefault(name, []).append((dt, action, line_no))
+
+    for person_punches in punches.values():
+        person_punches.sort(key=lambda x: (x[0], x[2]))
+    return punches, errors
+
+
+def merge_punches(name, existing, punches):
+    """將既有紀錄與新打卡依時間合併，並檢查簽到/簽退順序
+    existing: [(時間, 原始列)]（檔案順序，且必須已依時間排序，合併後既有列的相對順序不變）
+    punches: read_punch_file 的單人結果
+    回傳 (合併後的列, 匯入筆數, [(行號, 略過原因)])；若新紀錄會讓既有紀錄無法配對，整批不匯入
+    """
+    # 工時依檔案順序配對，補打卡造成時間倒序的檔案無法在不改變既有工時的情況下插入新紀錄
+    if any(later[0] < earlier[0] for earlier, later in zip(existing, existing[1:])):
+        return ([r for _, r in existing], 0,
+                [(punches[0][2] if punches else None,
+                  f"{name} 的既有紀錄有時間倒序（補打卡），請先至「資料檢查」確認，整批未匯入")])
+
+    existing_times = {dt for dt, _ in existing}
+    stream = heapq.merge(
+        ((dt, None, row, None) for dt, row in existing),
+        ((dt, action, None, line_no) for dt, action, line_no in punches),
+        key=lambda x: x[0],
+    )
+
+    merged = []
+    rejected = []
+    imported = 0
+    last_action = None
+    last_signin = None
+    last_import_line = None  # 目前狀態若是由新紀錄造成，記錄其行號
+    for dt, action, row, line_no in stream:
+        if row is not None:
+            # 既有紀錄：沿用原本的配對方式，但不能被新紀錄打亂
+            old_action = row[1]
+            if last_import_line is not None and (
+                (old_action == "簽到" and last_action == "簽到") or
+                (old_action == "簽退" and (last_action != "簽到" or dt <= last_signin))
+            ):
+                return ([r for _, r in existing], 0,
+                        [(last_import_line, f"會使既有紀錄 {row[3]} {old_action} 無法配對，{name} 整批未匯入")])
+            merged.append(row)
+            last_action = old_action
+            last_signin = dt if old_action == "簽到" else None
+            last_import_line = None
+            continue
+
+        if dt in existing_times:
+            rejected.append((line_no, f"{name} 於 {dt} 已有紀錄（重複）"))
+            continue
+        if action is None:
+            action = "簽退" if last_action == "簽到" else "簽到"
+        if action == "簽到" and last_action == "簽到":
+            rejected.append((line_no, f"{name} 上次已簽到，必須先簽退才能再簽到"))
+            continue
+        if action == "簽退":
+            if last_action != "簽到":
+                rejected.append((line_no, f"{name} 尚未簽到，或已簽退過，不能直接簽退"))
+                continue
+            if dt <= last_signin:
+                rejected.append((line_no, f"{name} 的簽退時間必須晚於簽到時間"))
+                continue
+        merged.append([name, action, dt.strftime("%Y-%m-%d"), dt.strftime("%Y-%m-%d %H:%M:%S"), "是"])
+        imported += 1
+        last_action = action
+        last_signin = dt if action == "簽到" else None
+        last_import_line = line_no
+
+    # 防呆：既有的每一組簽到退在合併後都必須維持原樣，否則過去的工時會被改變
+    kept = {(signin, signout) for signin, signout, _ in pair_punch_rows(merged)}
+    for signin, signout, _ in pair_punch_rows(r for _, r in existing):
+        if (signin, signout) not in kept:
+            return ([r for _, r in existing], 0,
+                    [(punches[0][2] if punches else None,
+                      f"會改變既有紀錄 {signin} ~ {signout} 的配對，{name} 整批未匯入")])
+    return merged, imported, rejected
+
+
 class AttendanceSystem(QWidget):
     def __init__(self):
         super().__init__()
@@ -119,17 +530,23 @@ class AttendanceSystem(QWidget):
         # --- 分頁 ---
         self.tabs = QTabWidget()
         self.attendance_tab = QWidget()
+        self.on_duty_tab = QWidget()
         self.staff_tab = QWidget()
         self.worktime_tab = QWidget()
         self.duty_tab = QWidget()
+        self.audit_tab = QWidget()
         self.tabs.addTab(self.attendance_tab, "打卡系統")
+        self.tabs.addTab(self.on_duty_tab, "目前值班")
         self.tabs.addTab(self.staff_tab, "人員設定")
         self.tabs.addTab(self.worktime_tab, "工時統計")
         self.tabs.addTab(self.duty_tab, "值班查詢")
+        self.tabs.addTab(self.audit_tab, "資料檢查")
 
         self.init_attendance_tab()
+        self.init_on_duty_tab()
         self.init_staff_tab()
         self.init_worktime_tab()
+        self.init_audit_tab()
 
         # --- 主版面 ---
         layout = QVBoxLayout()
@@ -140,12 +557,18 @@ class AttendanceSystem(QWidget):
         self.semester_btn.clicked.connect(self.change_semester)
         layout.addWidget(self.semester_btn)
 
+        rollover_btn = QPushButton("學期轉換（以目前人員建立新學期）")
+        rollover_btn.clicked.connect(self.rollover_semester)
+        layout.addWidget(rollover_btn)
+
         self.setLayout(layout)
 
         # 載入人員資料
         self.load_staff()
         self.load_attendance_records()
+        self.scan_on_duty()
         self.init_duty_query_tab()
+        self.init_file_watcher()
         self.tabs.setCurrentIndex(0)
         self.tabs.currentChanged.connect(self.check_password)
 
@@ -191,21 +614,254 @@ class AttendanceSystem(QWidget):
             wb.save(self.expected_file)
             wb.close()
 
+    def switch_semester(self, folder):
+        self.semester_folder = folder
+        self.semester_btn.setText(f"目前學期：{self.semester_folder.split('/')[-1]}")
+        self.staff_file = os.path.join(self.semester_folder, "staff.xlsx")
+        self.expected_file = os.path.join(self.semester_folder, "expected.xlsx")
+        self.ensure_semester_basics()
+        self.save_config()
+
     def change_semester(self):
         folder = QFileDialog.getExistingDirectory(self, "選擇學期資料夾")
         if folder:
-            self.semester_folder = folder
-            self.semester_btn.setText(f"目前學期：{self.semester_folder.split('/')[-1]}")
-            self.staff_file = os.path.join(self.semester_folder, "staff.xlsx")
-            self.expected_file = os.path.join(self.semester_folder, "expected.xlsx")
-            self.ensure_semester_basics()
-            self.save_config()
+            self.switch_semester(folder)
             # 重新載入該學期的資料
             self.load_staff()
             self.load_expected_worktime()
             self.refresh_worktime_name_combo()
             self.load_attendance_records()
             self.refresh_duty_name_combo()
+            self.scan_on_duty()
+            self.watch_semester_folder()
+
+    # ---------------- 檔案監看 ----------------
+    def init_file_watcher(self):
+        """監看學期資料夾，其他打卡機或管理員修改檔案時只更新受影響的資料"""
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.fileChanged.connect(self.on_file_changed)
+        self.file_watcher.directoryChanged.connect(self.on_file_changed)
+        # 存檔常會連續觸發多次，停止變動 500 毫秒後才一次處理
+        self.pending_changes = set()
+        self.change_timer = QTimer(self)
+        self.change_timer.setSingleShot(True)
+        self.change_timer.setInterval(500)
+        self.change_timer.timeout.connect(self.apply_file_changes)
+        self.watch_semester_folder()
+
+    def watch_semester_folder(self):
+        watched = self.file_watcher.files() + self.file_watcher.directories()
+        if watched:
+            self.file_watcher.removePaths(watched)
+        self.file_watcher.addPath(self.semester_folder)
+        files = [os.path.join(self.semester_folder, f) for f in os.listdir(self.semester_folder)
+                 if f.endswith(".xlsx") and not f.startswith("~$")]
+        if files:
+            self.file_watcher.addPaths(files)
+
+    def on_file_changed(self, path):
+        self.pending_changes.add(os.path.abspath(path))
+        self.change_timer.start()
+
+    def apply_file_changes(self):
+        changed, self.pending_changes = self.pending_changes, set()
+        watched = {os.path.abspath(p) for p in self.file_watcher.files()}
+        folder = os.path.abspath(self.semester_folder)
+
+        if folder in changed:
+            # 資料夾有新增檔案：加入監看並視為有變動
+            changed.discard(folder)
+            for f in os.listdir(self.semester_folder):
+                path = os.path.join(folder, f)
+                if f.endswith(".xlsx") and not f.startswith("~$") and path not in watched:
+                    changed.add(path)
+
+        roster_changed = False
+        expected_changed = False
+        people = set()
+        for path in changed:
+            if os.path.dirname(path) != folder:
+                continue
+            # 以「另存新檔再取代」方式儲存時，原本的監看會失效，需重新加入
+            if os.path.exists(path) and path not in watched:
+                self.file_watcher.addPath(path)
+            filename = os.path.basename(path)
+            if filename == os.path.basename(self.staff_file):
+                roster_changed = True
+            elif filename == os.path.basename(self.expected_file):
+                expected_changed = True
+            else:
+                people.add(filename[:-len(".xlsx")])
+
+        if roster_changed:
+            self.reload_staff_combos()
+        if expected_changed:
+            self.load_expected_worktime()
+        for name in people:
+            if self.staff_combo.findText(name) < 0:
+                continue
+            self.refresh_on_duty_person(name)
+            if name == self.staff_combo.currentText():
+                self.load_attendance_records()
+
+    def reload_staff_combos(self):
+        """人員名單被外部修改時，只讀一次 staff.xlsx 更新所有名單，並保留目前的選擇"""
+        names = self.get_staff_names()
+        previous = {self.staff_combo.itemText(i) for i in range(self.staff_combo.count())}
+        previous_name = self.staff_combo.currentText()
+        self.populate_staff_widgets(names)
+
+        if self.staff_combo.currentText() != previous_name:
+            self.load_attendance_records()
+        for name in list(self.on_duty):
+            if name not in names:
+                self.on_duty.pop(name)
+        for name in names:
+            if name not in previous:
+                signin = find_open_signin(self.get_attendance_file(name))
+                if signin:
+                    self.on_duty[name] = signin
+        self.render_on_duty_board()
+
+    def populate_staff_widgets(self, names):
+        """以給定的人員名單更新所有名單元件（不讀檔），並保留目前的選擇"""
+        self.staff_list.clear()
+        self.staff_list.addItems(names)
+        for combo in (self.staff_combo, self.worktime_name_combo, self.query_name_combo):
+            current = combo.currentText()
+            combo.blockSignals(True)
+            combo.clear()
+            combo.addItems(names)
+            idx = combo.findText(current)
+            if idx >= 0:
+                combo.setCurrentIndex(idx)
+            combo.blockSignals(False)
+        selected = {item.text() for item in self.query_name_list.selectedItems()}
+        self.query_name_list.clear()
+        self.query_name_list.addItems(names)
+        for i in range(self.query_name_list.count()):
+            if self.query_name_list.item(i).text() in selected:
+                self.query_name_list.item(i).setSelected(True)
+
+    def rollover_semester(self):
+        """學期轉換：結束舊學期未簽退的紀錄，一次寫入新學期的人員與應到工時，並直接以記憶體資料切換"""
+        pwd, ok = QInputDialog.getText(self, "密碼驗證", "請輸入管理員密碼：", QLineEdit.Password)
+        if not ok or pwd != self.admin_password:
+            QMessageBox.warning(self, "錯誤", "密碼錯誤，無法執行學期轉換！")
+            return
+        folder = QFileDialog.getExistingDirectory(self, "選擇（或新增）新學期資料夾")
+        if not folder:
+            return
+        if os.path.abspath(folder) == os.path.abspath(self.semester_folder):
+            QMessageBox.warning(self, "錯誤", "新學期資料夾不能與目前學期相同！")
+            return
+
+        names = self.get_staff_names()
+        expected = {name: hours for name, hours in self.expected_worktime.items() if name in names}
+
+        # 未簽退者以簽到當天 23:59:59（不晚於現在）補簽退；簽到時間不早於該時間者無法補簽退，略過
+        now = datetime.now()
+        close_outs = {}
+        skipped = []
+        for name, signin in self.on_duty.items():
+            signout = min(now, signin.replace(hour=23, minute=59, second=59))
+            if signout > signin:
+                close_outs[name] = signout
+            else:
+                skipped.append((name, signin))
+        message = f"將複製 {len(names)} 位人員與應到工時到「{os.path.basename(folder)}」並切換學期。"
+        if close_outs:
+            message += "\n\n以下人員尚未簽退，將自動補簽退：\n" + "\n".join(
+                f"{name}：{signout.strftime('%Y-%m-%d %H:%M:%S')}" for name, signout in close_outs.items())
+        if skipped:
+            message += "\n\n以下人員的簽到時間晚於現在，不會自動補簽退，請於舊學期手動處理：\n" + "\n".join(
+                f"{name}：簽到 {signin.strftime('%Y-%m-%d %H:%M:%S')}" for name, signin in skipped)
+        reply = QMessageBox.question(self, "學期轉換", message + "\n\n確定要執行嗎？",
+                                     QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+
+        # 先寫入並確認新學期資料，成功後才動舊學期的檔案
+        staff_file = os.path.join(folder, "staff.xlsx")
+        expected_file = os.path.join(folder, "expected.xlsx")
+        try:
+            os.makedirs(folder, exist_ok=True)
+            # 新學期資料夾若已有名單，保留原有人員與已設定的應到工時
+            if os.path.exists(staff_file):
+                wb = load_workbook(staff_file, read_only=True)
+                existing = [row[0] for row in wb.active.iter_rows(min_row=2, values_only=True) if row and row[0]]
+                wb.close()
+                names = existing + [name for name in names if name not in existing]
+            if os.path.exists(expected_file):
+                wb = load_workbook(expected_file, read_only=True)
+                for row in wb.active.iter_rows(min_row=2, values_only=True):
+                    if row and row[0] and row[1] is not None:
+                        try:
+                            expected[row[0]] = float(row[1])
+                        except (TypeError, ValueError):
+                            pass
+                wb.close()
+
+            wb = Workbook()
+            ws = wb.active
+            ws.append(["姓名"])
+            for name in names:
+                ws.append([name])
+            wb.save(staff_file)
+            wb.close()
+            wb = Workbook()
+            ws = wb.active
+            ws.append(["姓名", "應到工時"])
+            for name, hours in expected.items():
+                ws.append([name, hours])
+            wb.save(expected_file)
+            wb.close()
+
+            wb = load_workbook(staff_file, read_only=True)
+            written_names = [row[0] for row in wb.active.iter_rows(min_row=2, values_only=True) if row and row[0]]
+            wb.close()
+            wb = load_workbook(expected_file, read_only=True)
+            written_expected = {row[0]: row[1] for row in wb.active.iter_rows(min_row=2, values_only=True)
+                                if row and row[0]}
+            wb.close()
+        except Exception as e:
+            QMessageBox.critical(self, "錯誤", f"無法寫入新學期資料夾，學期未轉換，舊學期資料未變更：\n{e}")
+            return
+        if written_names != names or written_expected != expected:
+            QMessageBox.critical(self, "錯誤", "新學期的人員或應到工時寫入後內容不符，學期未轉換，舊學期資料未變更！")
+            return
+
+        # 最後才結束舊學期的未簽退紀錄
+        failed = []
+        for name, signout in close_outs.items():
+            file = self.get_attendance_file(name)
+            try:
+                wb = load_workbook(file)
+                ws = wb.active
+                if ws.cell(row=1, column=5).value is None:
+                    ws.cell(row=1, column=5, value="補打卡")
+                ws.append([name, "簽退", signout.strftime("%Y-%m-%d"), signout.strftime("%Y-%m-%d %H:%M:%S"), "是"])
+                wb.save(file)
+                wb.close()
+            except Exception:
+                failed.append(name)
+
+        # 切換學期，直接用記憶體中的資料建立快取，不再逐一讀檔重算
+        self.switch_semester(folder)
+        self.expected_worktime = expected
+        self.populate_staff_widgets(names)
+        self.on_duty = {}
+        for name in names:
+            signin = find_open_signin(self.get_attendance_file(name))
+            if signin:
+                self.on_duty[name] = signin
+        self.render_on_duty_board()
+        self.load_attendance_records()
+        self.calculate_worktime()
+        self.watch_semester_folder()
+        QMessageBox.information(self, "成功", f"已切換到新學期「{os.path.basename(folder)}」，共 {len(names)} 位人員！")
+        if failed:
+            QMessageBox.warning(self, "注意", "以下人員在舊學期的自動補簽退寫入失敗，請手動補簽退：\n" + "\n".join(failed))
 
     # ---------------- 驗證密碼 ----------------
     def check_password(self, index):
@@ -234,8 +890,24 @@ class AttendanceSystem(QWidget):
         del_btn.clicked.connect(self.delete_staff)
         layout.addWidget(del_btn)
 
+        import_btn = QPushButton("批次匯入打卡紀錄（CSV / 刷卡機檔）")
+        import_btn.clicked.connect(self.bulk_import_records)
+        layout.addWidget(import_btn)
+
         self.staff_tab.setLayout(layout)
 
+    def get_staff_names(self):
+        """依 staff.xlsx 順序回傳本學期人員姓名"""
+        names = []
+        if os.path.exists(self.staff_file):
+            wb = load_workbook(self.staff_file, read_only=True)
+            ws = wb.active
+            for row in ws.iter_rows(min_row=2, values_only=True):
+                if row and row[0]:
+                    names.append(row[0])
+            wb.close()
+        return names
+
     def load_staff(self):
         self.staff_list.clear()
         self.staff_combo.clear()
@@ -275,6 +947,7 @@ class AttendanceSystem(QWidget):
         self.staff_combo.addItem(name)
         self.worktime_name_combo.addItem(name)
         self.query_name_combo.addItem(name)
+        self.query_name_list.addItem(name)
         self.name_input.clear()
 
     def delete_staff(self):
@@ -304,6 +977,88 @@ class AttendanceSystem(QWidget):
         idx3 = self.query_name_combo.findText(name)   # 🔹 新增這段
         if idx3 >= 0:
             self.query_name_combo.removeItem(idx3)
+        for item in self.query_name_list.findItems(name, Qt.MatchExactly):
+            self.query_name_list.takeItem(self.query_name_list.row(item))
+        self.set_on_duty(name, None)
+
+    def bulk_import_records(self):
+        """批次匯入打卡紀錄：先依人員合併檢查並預覽，確認後每人的檔案只寫入一次"""
+        path, _ = QFileDialog.getOpenFileName(self, "選擇打卡紀錄檔", "", "CSV Files (*.csv *.txt)")
+        if not path:
+            return
+
+        punches, errors = read_punch_file(path)
+        total = sum(len(p) for p in punches.values()) + len(errors)
+        report = [f"第 {line_no} 行：{reason}" for line_no, reason in errors]
+        staff = set(self.get_staff_names())
+        plans = {}  # 姓名 -> (合併後要寫回的列, 讀取時的檔案狀態, 匯入筆數)
+        imported_total = 0
+        for name, person_punches in punches.items():
+            if name not in staff:
+                report.append(f"{name}：不在本學期人員名單中，{len(person_punches)} 筆未匯入")
+                continue
+            existing = []
+            file = self.get_attendance_file(name)
+            # 先記下檔案狀態，寫入前再比對，避免覆蓋預覽期間其他打卡機寫入的紀錄
+            stamp = file_stamp(file) if os.path.exists(file) else None
+            if stamp:
+                wb = load_workbook(file, read_only=True)
+                ws = wb.active
+                existing = [list(r) for r in ws.iter_rows(min_row=2, values_only=True) if r and r[1]]
+                wb.close()
+            try:
+                existing = [(datetime.strptime(r[3], "%Y-%m-%d %H:%M:%S"), r) for r in existing]
+            except (TypeError, ValueError):
+                report.append(f"{name}：既有紀錄時間格式錯誤，請先至「資料檢查」修正，{len(person_punches)} 筆未匯入")
+                continue
+
+            rows, imported, rejected = merge_punches(name, existing, person_punches)
+            report.extend(f"第 {line_no} 行：{reason}" for line_no, reason in rejected)
+            if imported:
+                plans[name] = (rows, stamp, imported)
+                imported_total += imported
+
+        summary = f"共 {total} 筆，可匯入 {imported_total} 筆（{len(plans)} 人），略過 {total - imported_total} 筆。"
+        if not plans:
+            box = QMessageBox(QMessageBox.Warning, "匯入預覽", summary + "\n沒有可匯入的紀錄。", QMessageBox.Ok, self)
+            box.setDetailedText("\n".join(report))
+            box.exec_()
+            return
+        box = QMessageBox(QMessageBox.Question, "匯入預覽", summary + "\n確定要寫入嗎？",
+                          QMessageBox.Yes | QMessageBox.No, self)
+        if report:
+            box.setDetailedText("\n".join(report))
+        if box.exec_() != QMessageBox.Yes:
+            return
+
+        # 寫入（每人一次）；預覽後檔案若已被修改則略過該人員，不覆蓋
+        changed = []
+        for name, (rows, stamp, imported) in plans.items():
+            file = self.get_attendance_file(name)
+            current = file_stamp(file) if os.path.exists(file) else None
+            if current != stamp:
+                changed.append(name)
+                imported_total -= imported
+                continue
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet()
+            ws.append(["姓名", "動作", "日期", "時間", "補打卡"])
+            for row in rows:
+                ws.append(row)
+            wb.save(file)
+            wb.close()
+            last = rows[-1]
+            self.set_on_duty(name, datetime.strptime(last[3], "%Y-%m-%d %H:%M:%S") if last[1] == "簽到" else None)
+
+        if changed:
+            QMessageBox.warning(
+                self, "部分未匯入",
+                f"已匯入 {imported_total} 筆打卡紀錄。\n以下人員的檔案在預覽期間被修改（例如其他打卡機打卡），"
+                f"為避免覆蓋新紀錄未匯入，請重新匯入：\n" + "\n".join(changed)
+            )
+        else:
+            QMessageBox.information(self, "成功", f"已匯入 {imported_total} 筆打卡紀錄！")
+        self.load_attendance_records()
 
     # ---------------- 打卡系統 ----------------
     def init_attendance_tab(self):
@@ -375,7 +1130,7 @@ class AttendanceSystem(QWidget):
         records = records[-10:]
         self.record_table.setRowCount(len(records))
         for i, row in enumerate(records):
-            for j, value in enumerate(row):
+            for j, value in enumerate(row[:4]):
                 item = QTableWidgetItem(str(value))
                 item.setTextAlignment(Qt.AlignCenter)  # 新增這行
                 self.record_table.setItem(i, j, item)
@@ -425,7 +1180,13 @@ class AttendanceSystem(QWidget):
                 ws.delete_rows(r[0].row, 1)
                 break
         wb.save(file)
+        # 刪除後以最後一筆紀錄更新值班狀態
+        last = None
+        for r in ws.iter_rows(min_row=2, values_only=True):
+            if r and r[1]:
+                last = r
         wb.close()
+        self.set_on_duty(name, datetime.strptime(last[3], "%Y-%m-%d %H:%M:%S") if last and last[1] == "簽到" else None)
 
         QMessageBox.information(self, "成功", "紀錄已刪除！")
         self.load_attendance_records()
@@ -460,7 +1221,7 @@ class AttendanceSystem(QWidget):
         if not os.path.exists(file):
             wb = Workbook()
             ws = wb.active
-            ws.append(["姓名", "動作", "日期", "時間"])
+            ws.append(["姓名", "動作", "日期", "時間", "補打卡"])
             wb.save(file)
             wb.close()
 
@@ -491,14 +1252,69 @@ class AttendanceSystem(QWidget):
                 wb.close()
                 return
 
-        # 寫入
-        ws.append([name, action, now_date, now_time])
+        # 寫入（補打卡另外標記，供分析匯出使用）
+        if is_manual and ws.cell(row=1, column=5).value is None:
+            ws.cell(row=1, column=5, value="補打卡")
+        ws.append([name, action, now_date, now_time, "是" if is_manual else None])
         wb.save(file)
         wb.close()
+        self.set_on_duty(name, dt if action == "簽到" else None)
         QMessageBox.information(self, "成功", f"{name} 已完成 {action}！")
         self.load_attendance_records()
 
 
+    # ---------------- 目前值班 ----------------
+    def init_on_duty_tab(self):
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("目前已簽到、尚未簽退的人員："))
+        self.on_duty_table = QTableWidget()
+        self.on_duty_table.setColumnCount(3)
+        self.on_duty_table.setHorizontalHeaderLabels(["姓名", "簽到時間", "已值班時長"])
+        header = self.on_duty_table.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+        header.setStretchLastSection(True)
+        layout.addWidget(self.on_duty_table)
+        self.on_duty_tab.setLayout(layout)
+
+        # 姓名 -> 簽到時間；啟動時掃描一次，之後由打卡事件逐筆更新
+        self.on_duty = {}
+        # 每分鐘只更新已值班時長，不重新讀檔
+        self.on_duty_timer = QTimer(self)
+        self.on_duty_timer.timeout.connect(self.render_on_duty_board)
+        self.on_duty_timer.start(60 * 1000)
+
+    def scan_on_duty(self):
+        """掃描本學期所有人員檔案，建立目前值班名單"""
+        self.on_duty = {}
+        for name in self.get_staff_names():
+            signin = find_open_signin(self.get_attendance_file(name))
+            if signin:
+                self.on_duty[name] = signin
+        self.render_on_duty_board()
+
+    def refresh_on_duty_person(self, name):
+        """只重新讀取單一人員的檔案（例如其他打卡機修改了檔案）"""
+        self.set_on_duty(name, find_open_signin(self.get_attendance_file(name)))
+
+    def set_on_duty(self, name, signin):
+        if signin:
+            self.on_duty[name] = signin
+        else:
+            self.on_duty.pop(name, None)
+        self.render_on_duty_board()
+
+    def render_on_duty_board(self):
+        now = datetime.now()
+        records = sorted(self.on_duty.items(), key=lambda x: x[1])
+        self.on_duty_table.setRowCount(len(records))
+        for i, (name, signin) in enumerate(records):
+            elapsed = max(int((now - signin).total_seconds() // 60), 0)
+            row = [name, signin.strftime("%Y-%m-%d %H:%M:%S"), self.format_minutes(elapsed)]
+            for j, value in enumerate(row):
+                item = QTableWidgetItem(value)
+                item.setTextAlignment(Qt.AlignCenter)
+                self.on_duty_table.setItem(i, j, item)
+
     # ---------------- 工時 ----------------
     def init_worktime_tab(self):
         layout = QVBoxLayout()
@@ -526,6 +1342,9 @@ class AttendanceSystem(QWidget):
         export_btn = QPushButton("匯出結果到 Excel")
         export_btn.clicked.connect(lambda: self.calculate_worktime(export=True))
         layout.addWidget(export_btn)
+        sessions_export_btn = QPushButton("匯出值班明細供分析（CSV / JSON Lines）")
+        sessions_export_btn.clicked.connect(self.export_sessions)
+        layout.addWidget(sessions_export_btn)
 
         self.worktime_tab.setLayout(layout)
         # 準備資料
@@ -566,33 +1385,15 @@ class AttendanceSystem(QWidget):
         end_date = self.export_end_date.date().toPyDate() if self.export_end_date.date().isValid() else None
 
         worktime = {}
-        if os.path.exists(self.staff_file):
-            wb = load_workbook(self.staff_file)
-            ws = wb.active
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                name = row[0]
-                if not name:
-                    continue
-                file = self.get_attendance_file(name)
-                if os.path.exists(file):
-                    w = load_workbook(file)
-                    s = w.active
-                    last_signin = None
-                    for r in s.iter_rows(min_row=2, values_only=True):
-                        _, action, _, timestamp = r
-                        dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-                        if action == "簽到":
-                            last_signin = dt
-                        elif action == "簽退" and last_signin:
-                            # 檢查日期篩選
-                            if (start_date is None or last_signin.date() >= start_date) and \
-                               (end_date is None or dt.date() <= end_date):
-                                delta = dt - last_signin
-                                minutes = int(delta.total_seconds() // 60)
-                                worktime[name] = worktime.get(name, 0) + minutes
-                            last_signin = None
-                    w.close()
-            wb.close()
+        for name in self.get_staff_names():
+            file = self.get_attendance_file(name)
+            if os.path.exists(file):
+                for signin, signout in iter_sessions(file):
+                    # 檢查日期篩選
+                    if (start_date is None or signin.date() >= start_date) and \
+                       (end_date is None or signout.date() <= end_date):
+                        minutes = int((signout - signin).total_seconds() // 60)
+                        worktime[name] = worktime.get(name, 0) + minutes
 
         # 若無打卡，但 expected 有資料，也要顯示
         for name in self.expected_worktime.keys():
@@ -624,59 +1425,104 @@ class AttendanceSystem(QWidget):
                             self.format_minutes(diff_minutes, show_sign=True)])
         # 匯出
         if export:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "工時總表"
-            ws.append(["姓名", "應到工時", "實際工時", "差異"])
-            for row in results:
-                ws.append(row)
+            self.export_worktime(worktime, results, start_date, end_date)
+
 
-            # 匯出時段
-            start_date = self.export_start_date.date().toPyDate() if self.export_start_date.date().isValid() else None
-            end_date = self.export_end_date.date().toPyDate() if self.export_end_date.date().isValid() else None
 
+    def export_worktime(self, worktime, results, start_date, end_date):
+        """匯出工時：各人的明細在子行程產生，再組成單一活頁簿或每人一檔的 zip"""
+        modes = ["單一 Excel 活頁簿", "每人一個檔案（zip）"]
+        mode, ok = QInputDialog.getItem(self, "匯出方式", "請選擇匯出方式：", modes, 0, False)
+        if not ok:
+            return
+        as_zip = mode == modes[1]
+
+        # 儲存位置
+        base_name = f"{os.path.basename(self.semester_folder)}_worktime_result"
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "儲存工時計算結果",
+            os.path.join(self.semester_folder, base_name + (".zip" if as_zip else ".xlsx")),
+            "Zip Files (*.zip)" if as_zip else "Excel Files (*.xlsx)"
+        )
+        if not file_path:
+            return
+
+        names = list(worktime.keys())
+        progress = QProgressDialog("正在產生各人員明細…", "取消", 0, len(names) + 1, self)
+        progress.setWindowTitle("匯出工時")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+
+        # zip 模式連 xlsx 序列化都在子行程完成；活頁簿模式子行程只產生內容列
+        worker = build_person_workbook if as_zip else build_person_sheet_rows
+        contents = {}
+        with ProcessPoolExecutor(max_workers=min(max(len(names), 1), os.cpu_count() or 1)) as executor:
+            futures = [executor.submit(worker, name, self.get_attendance_file(name), start_date, end_date)
+                       for name in names]
+            for done, future in enumerate(as_completed(futures), start=1):
+                name, content = future.result()
+                contents[name] = content
+                progress.setValue(done)
+                QApplication.processEvents()
+                if progress.wasCanceled():
+                    for f in futures:
+                        f.cancel()
+                    return
+
+        progress.setLabelText("正在寫入檔案…")
+        QApplication.processEvents()
+        summary = [["姓名", "應到工時", "實際工時", "差異"]] + results
+        if as_zip:
+            with zipfile.ZipFile(file_path, "w", zipfile.ZIP_STORED) as zf:
+                zf.writestr("工時總表.xlsx", rows_to_xlsx_bytes("工時總表", summary))
+                for name in names:
+                    zf.writestr(f"{name}.xlsx", contents[name])
+        else:
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet(title="工時總表")
+            for row in summary:
+                ws.append(row)
             # 為每個人建立副表單
-            for name in worktime.keys():
+            for name in names:
                 sub_ws = wb.create_sheet(title=name)
-                sub_ws.append(["姓名", "簽到時間", "簽退時間", "值班時長"])
-
-                file = self.get_attendance_file(name)
-                if os.path.exists(file):
-                    pwb = load_workbook(file)
-                    ps = pwb.active
-                    last_signin = None
-                    for r in ps.iter_rows(min_row=2, values_only=True):
-                        _, action, date_str, timestamp = r
-                        dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-                        if action == "簽到":
-                            last_signin = dt
-                        elif action == "簽退" and last_signin:
-                            if (start_date is None or last_signin.date() >= start_date) and \
-                               (end_date is None or dt.date() <= end_date):
-                                delta = dt - last_signin
-                                hours = int(delta.total_seconds() // 3600)
-                                minutes = int((delta.total_seconds() % 3600) // 60)
-                                duration = f"{hours:02d}:{minutes:02d}"
-                                sub_ws.append([name,
-                                               last_signin.strftime("%Y-%m-%d %H:%M:%S"),
-                                               dt.strftime("%Y-%m-%d %H:%M:%S"),
-                                               duration])
-                            last_signin = None
-                    pwb.close()
-
-            # 儲存
-            default_name = f"{os.path.basename(self.semester_folder)}_worktime_result.xlsx"
-            file_path, _ = QFileDialog.getSaveFileName(
-                self, "儲存工時計算結果",
-                os.path.join(self.semester_folder, default_name),
-                "Excel Files (*.xlsx)"
-            )
-            if file_path:
-                wb.save(file_path)
-                QMessageBox.information(self, "匯出完成", f"工時計算結果已輸出到 {file_path}")
+                for row in contents[name]:
+                    sub_ws.append(row)
+            wb.save(file_path)
             wb.close()
-
-
+        progress.setValue(len(names) + 1)
+        QMessageBox.information(self, "匯出完成", f"工時計算結果已輸出到 {file_path}")
+
+    def export_sessions(self):
+        """串流匯出本學期所有配對好的值班紀錄（epoch 秒數），不經過 HH:MM 格式"""
+        base_name = f"{os.path.basename(self.semester_folder)}_sessions"
+        jsonl_filter = "JSON Lines (*.jsonl)"
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "匯出值班明細",
+            os.path.join(self.semester_folder, base_name),
+            f"CSV Files (*.csv);;{jsonl_filter}"
+        )
+        if not file_path:
+            return
+        # 使用者有輸入 .csv / .jsonl 就依副檔名；否則依選擇的類型並補上副檔名
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension in (".csv", ".jsonl"):
+            as_csv = extension == ".csv"
+        else:
+            as_csv = selected_filter != jsonl_filter
+            file_path += ".csv" if as_csv else ".jsonl"
+            if os.path.exists(file_path):
+                reply = QMessageBox.question(
+                    self, "確認覆寫", f"{file_path} 已存在，確定要覆寫嗎？",
+                    QMessageBox.Yes | QMessageBox.No
+                )
+                if reply != QMessageBox.Yes:
+                    return
+
+        names = self.get_staff_names()
+        rows = iter_session_export_rows(names, [self.get_attendance_file(name) for name in names])
+        with open(file_path, "w", encoding="utf-8", newline="") as f:
+            count = write_sessions_csv(f, rows) if as_csv else write_sessions_jsonl(f, rows)
+        QMessageBox.information(self, "匯出完成", f"共 {count} 筆值班紀錄已輸出到 {file_path}")
 
     def format_minutes(self, minutes, show_sign=False):
         sign = ""
@@ -760,6 +1606,16 @@ class AttendanceSystem(QWidget):
         query_btn.clicked.connect(self.load_duty_records)
         layout.addWidget(query_btn)
 
+        # 多人查詢
+        layout.addWidget(QLabel("多人合併查詢（可複選）："))
+        self.query_name_list = QListWidget()
+        self.query_name_list.setSelectionMode(QListWidget.MultiSelection)
+        self.query_name_list.setMaximumHeight(120)
+        layout.addWidget(self.query_name_list)
+        multi_query_btn = QPushButton("查詢多人值班時間軸")
+        multi_query_btn.clicked.connect(self.load_merged_duty_records)
+        layout.addWidget(multi_query_btn)
+
         # 顯示表格
         self.duty_table = QTableWidget()
         self.duty_table.setColumnCount(4)
@@ -769,6 +1625,16 @@ class AttendanceSystem(QWidget):
         header.setStretchLastSection(True)
         layout.addWidget(self.duty_table)
 
+        # 多人查詢的時段覆蓋（人數 0 為無人值班）
+        layout.addWidget(QLabel("值班覆蓋時段（多人查詢）："))
+        self.coverage_table = QTableWidget()
+        self.coverage_table.setColumnCount(3)
+        self.coverage_table.setHorizontalHeaderLabels(["開始時間", "結束時間", "在班人數"])
+        header = self.coverage_table.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+        header.setStretchLastSection(True)
+        layout.addWidget(self.coverage_table)
+
         self.duty_tab.setLayout(layout)
 
         # 載入人員
@@ -776,12 +1642,14 @@ class AttendanceSystem(QWidget):
     
     def refresh_duty_name_combo(self):
         self.query_name_combo.clear()
+        self.query_name_list.clear()
         if os.path.exists(self.staff_file):
             wb = load_workbook(self.staff_file)
             ws = wb.active
             for row in ws.iter_rows(min_row=2, values_only=True):
                 if row and row[0]:
                     self.query_name_combo.addItem(row[0])
+                    self.query_name_list.addItem(row[0])
             wb.close()
 
     def load_duty_records(self):
@@ -803,45 +1671,136 @@ class AttendanceSystem(QWidget):
             QMessageBox.warning(self, "錯誤", "起始日期不能晚於結束日期！")
             return
 
-        wb = load_workbook(file)
-        ws = wb.active
+        sessions = load_person_sessions(name, file, start_date, end_date)
+        self.coverage_table.setRowCount(0)
+        self.show_duty_sessions(sessions)
 
-        records = []
-        last_signin = None
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            _, action, date_str, timestamp = row
-            dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-            if action == "簽到":
-                last_signin = dt
-            elif action == "簽退" and last_signin:
-                # 比對日期（只看年月日）
-                if start_date <= last_signin.date() <= end_date or start_date <= dt.date() <= end_date:
-                    delta = dt - last_signin
-                    hours = delta.total_seconds() // 3600
-                    minutes = (delta.total_seconds() % 3600) // 60
-                    duration = f"{int(hours):02d}:{int(minutes):02d}"
-                    records.append([name,
-                                    last_signin.strftime("%Y-%m-%d %H:%M:%S"),
-                                    dt.strftime("%Y-%m-%d %H:%M:%S"),
-                                    duration])
-                last_signin = None
-        wb.close()
+    def load_merged_duty_records(self):
+        """同時查詢多人的值班紀錄，合併成一條依簽到時間排序的時間軸，並列出各時段在班人數"""
+        names = [item.text() for item in self.query_name_list.selectedItems()]
+        if not names:
+            QMessageBox.warning(self, "錯誤", "請先選擇要查詢的人員！")
+            return
 
-        # 依照簽到時間排序
-        records.sort(key=lambda x: datetime.strptime(x[1], "%Y-%m-%d %H:%M:%S"))
+        start_date = self.start_date.date().toPyDate()
+        end_date = self.end_date.date().toPyDate()
+        if start_date > end_date:
+            QMessageBox.warning(self, "錯誤", "起始日期不能晚於結束日期！")
+            return
 
-        # 顯示到表格
-        self.duty_table.setRowCount(len(records))
-        for i, row in enumerate(records):
+        # 各人的查詢平行執行，每份結果都已依簽到時間排序
+        # 每人只讀一個小檔，用執行緒即可，避免每次查詢都啟動子行程（exe 模式下特別慢）
+        files = [self.get_attendance_file(name) for name in names]
+        with ThreadPoolExecutor(max_workers=min(len(names), os.cpu_count() or 1)) as executor:
+            per_person = list(executor.map(load_person_sessions, names, files,
+                                           repeat(start_date), repeat(end_date)))
+
+        sessions = list(heapq.merge(*per_person, key=lambda x: x[0]))
+        self.show_duty_sessions(sessions)
+
+        range_start = datetime.combine(start_date, datetime.min.time())
+        range_end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+        slots = list(coverage_slots(sessions, range_start, range_end))
+        self.coverage_table.setRowCount(len(slots))
+        for i, (slot_start, slot_end, count) in enumerate(slots):
+            row = [slot_start.strftime("%Y-%m-%d %H:%M:%S"), slot_end.strftime("%Y-%m-%d %H:%M:%S"), str(count)]
+            for j, value in enumerate(row):
+                item = QTableWidgetItem(value)
+                item.setTextAlignment(Qt.AlignCenter)
+                if count == 0:
+                    item.setBackground(QColor("#F8D7DA"))  # 無人值班
+                self.coverage_table.setItem(i, j, item)
+        self.coverage_table.resizeColumnsToContents()
+
+    def show_duty_sessions(self, sessions):
+        """將 [(簽到, 簽退, 姓名)] 顯示到值班紀錄表格"""
+        self.duty_table.setRowCount(len(sessions))
+        for i, (signin, signout, name) in enumerate(sessions):
+            delta = signout - signin
+            hours = delta.total_seconds() // 3600
+            minutes = (delta.total_seconds() % 3600) // 60
+            duration = f"{int(hours):02d}:{int(minutes):02d}"
+            row = [name, signin.strftime("%Y-%m-%d %H:%M:%S"), signout.strftime("%Y-%m-%d %H:%M:%S"), duration]
             for j, value in enumerate(row):
                 item = QTableWidgetItem(str(value))
                 item.setTextAlignment(Qt.AlignCenter)
                 self.duty_table.setItem(i, j, item)
         self.duty_table.resizeColumnsToContents()
 
+    # ---------------- 資料檢查 ----------------
+    def init_audit_tab(self):
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("檢查本學期所有人員的打卡資料（孤立簽退、未簽退、時間倒序、時段重疊）："))
+        audit_btn = QPushButton("開始檢查")
+        audit_btn.clicked.connect(self.run_audit)
+        layout.addWidget(audit_btn)
+
+        self.audit_summary_label = QLabel("")
+        layout.addWidget(self.audit_summary_label)
+
+        self.audit_table = QTableWidget()
+        self.audit_table.setColumnCount(4)
+        self.audit_table.setHorizontalHeaderLabels(["姓名", "列號", "問題", "說明"])
+        header = self.audit_table.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+        header.setStretchLastSection(True)
+        layout.addWidget(self.audit_table)
+
+        self.audit_tab.setLayout(layout)
+        # 檔案路徑 -> (((修改時間, 大小), 檢查日期), 檢查結果)，檔案未變動就不重新檢查
+        self.audit_cache = {}
+
+    def run_audit(self):
+        """檢查所有人員的打卡檔，只重新檢查有變動的檔案；變動的檔案多時才平行處理"""
+        files = []
+        for name in self.get_staff_names():
+            file = self.get_attendance_file(name)
+            if os.path.exists(file):
+                files.append((name, file))
+
+        # 「值班中」與「未簽退」依日期判斷，跨日後快取也要重新檢查
+        today = datetime.now().date()
+        stale = []
+        for name, file in files:
+            stamp = (file_stamp(file), today)
+            cached = self.audit_cache.get(file)
+            if not cached or cached[0] != stamp:
+                stale.append((file, stamp))
+
+        if len(stale) >= AUDIT_POOL_MIN_FILES:
+            # 第一次完整檢查：檔案多，用多個子行程平行處理
+            with ProcessPoolExecutor(max_workers=min(len(stale), os.cpu_count() or 1)) as executor:
+                results = list(executor.map(audit_attendance_file, [file for file, _ in stale], repeat(today)))
+        else:
+            # 修正後重新檢查通常只有少數檔案變動，直接檢查即可
+            results = [audit_attendance_file(file, today) for file, _ in stale]
+        for (file, stamp), issues in zip(stale, results):
+            self.audit_cache[file] = (stamp, issues)
+
+        records = []
+        for name, file in files:
+            for row_no, kind, detail in self.audit_cache[file][1]:
+                records.append([name, "-" if row_no is None else row_no, kind, detail])
+
+        info_count = sum(1 for row in records if row[2] in AUDIT_INFO_KINDS)
+        self.audit_summary_label.setText(
+            f"共檢查 {len(files)} 個檔案（重新檢查 {len(stale)} 個），"
+            f"發現 {len(records) - info_count} 筆異常、{info_count} 筆提醒"
+        )
+        self.audit_table.setRowCount(len(records))
+        for i, row in enumerate(records):
+            for j, value in enumerate(row):
+                item = QTableWidgetItem(str(value))
+                item.setTextAlignment(Qt.AlignCenter)
+                if row[2] in AUDIT_INFO_KINDS:
+                    item.setForeground(QColor("#808080"))  # 提醒，非異常
+                self.audit_table.setItem(i, j, item)
+        self.audit_table.resizeColumnsToContents()
 
 
 if __name__ == "__main__":
+    # 打包成 exe 時，子行程（平行檢查）需要此設定
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = AttendanceSystem()
     window.show()